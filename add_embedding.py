@@ -4,6 +4,7 @@ import requests
 import psycopg2
 from dotenv import load_dotenv
 from tqdm import tqdm
+from get_businesses import ensure_refresh_columns
 
 load_dotenv()
 
@@ -36,8 +37,71 @@ def get_embedding(text, retries=3):
     
     raise Exception(f"Failed after {retries} retries")
 
+# gemini-embedding-001 default output size
+EMBEDDING_DIM = 3072
+
+def ensure_business_embeddings_table(cur):
+    """One pooled vector per business, used as the coarse first stage of search"""
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS business_embeddings (
+            business_id TEXT PRIMARY KEY REFERENCES businesses(place_id) ON DELETE CASCADE,
+            embedding vector({EMBEDDING_DIM}),
+            chunk_count INTEGER,
+            updated_at TIMESTAMPTZ DEFAULT now()
+        )
+    """)
+    # pgvector can't index plain vectors above 2000 dims, so index the halfvec cast;
+    # search orders by the same expression to use it
+    cur.execute(f"""
+        CREATE INDEX IF NOT EXISTS business_embeddings_embedding_idx
+        ON business_embeddings USING hnsw ((embedding::halfvec({EMBEDDING_DIM})) halfvec_cosine_ops)
+    """)
+    # Postgres doesn't index FK columns; stage 2 and sync_chunks look chunks up by business
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS business_chunks_business_id_idx ON business_chunks (business_id)
+    """)
+
+def refresh_business_embeddings(cur):
+    """Recompute centroids for businesses whose chunks changed since their centroid
+    was built (edited, NULLed, inserted or deleted), and drop centroids with no
+    embedded chunks left"""
+    cur.execute("""
+        WITH stale AS (
+            SELECT c.business_id
+            FROM business_chunks c
+            LEFT JOIN business_embeddings e ON e.business_id = c.business_id
+            GROUP BY c.business_id, e.updated_at, e.chunk_count
+            HAVING e.updated_at IS NULL
+                OR MAX(c.updated_at) > e.updated_at
+                OR COUNT(c.embedding) <> e.chunk_count
+        )
+        INSERT INTO business_embeddings (business_id, embedding, chunk_count, updated_at)
+        SELECT c.business_id, AVG(c.embedding), COUNT(*), now()
+        FROM business_chunks c
+        JOIN stale s ON s.business_id = c.business_id
+        WHERE c.embedding IS NOT NULL
+        GROUP BY c.business_id
+        ON CONFLICT (business_id) DO UPDATE SET
+            embedding = EXCLUDED.embedding,
+            chunk_count = EXCLUDED.chunk_count,
+            updated_at = EXCLUDED.updated_at
+    """)
+    updated = cur.rowcount
+    cur.execute("""
+        DELETE FROM business_embeddings e
+        WHERE NOT EXISTS (
+            SELECT 1 FROM business_chunks c
+            WHERE c.business_id = e.business_id AND c.embedding IS NOT NULL
+        )
+    """)
+    return updated, cur.rowcount
+
 conn = psycopg2.connect(DB_URL)
 cur = conn.cursor()
+ensure_refresh_columns(cur)  # business_chunks.updated_at drives centroid staleness
+ensure_business_embeddings_table(cur)
+refresh_business_embeddings(cur)  # backfill centroids for chunks embedded before this table existed
+conn.commit()
 
 cur.execute("SELECT id, chunk_text FROM business_chunks WHERE embedding IS NULL")
 rows = cur.fetchall()
@@ -51,7 +115,7 @@ for i, (row_id, chunk_text) in enumerate(tqdm(rows)):
         embedding = get_embedding(chunk_text)
         
         cur.execute(
-            "UPDATE business_chunks SET embedding = %s WHERE id = %s",
+            "UPDATE business_chunks SET embedding = %s, updated_at = now() WHERE id = %s",
             (embedding, row_id)
         )
         
@@ -65,6 +129,11 @@ for i, (row_id, chunk_text) in enumerate(tqdm(rows)):
         continue
 
 conn.commit()
+
+updated, removed = refresh_business_embeddings(cur)
+conn.commit()
+print(f"Updated {updated} business embeddings, removed {removed}")
+
 cur.close()
 conn.close()
 print("Done!")
\ No newline at end of file
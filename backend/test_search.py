@@ -1,6 +1,7 @@
 import os
 import requests
 import psycopg2
+import psycopg2.errors
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -24,13 +25,60 @@ def get_query_embedding(text):
     resp.raise_for_status()
     return resp.json()["embedding"]["values"]
 
-def search_businesses(query, limit=10):
-    conn = psycopg2.connect(DB_URL)
-    cur = conn.cursor()
-    
-    query_vector = get_query_embedding(query)
-    
-    # Group by business and get the best matching chunk per business
+# Businesses kept from the coarse stage, per requested result
+SHORTLIST_FACTOR = 5
+MAX_EF_SEARCH = 1000
+# Must match EMBEDDING_DIM in add_embedding.py (the HNSW index is on this halfvec cast)
+EMBEDDING_DIM = 3072
+
+def shortlist_search(cur, query_vector, limit):
+    """Two-stage search: shortlist businesses by their pooled embedding (scales with
+    businesses, not reviews), then score chunks of the shortlist only to pick the
+    best matching chunk per business"""
+    # HNSW returns at most ef_search candidates, and pgvector caps ef_search at 1000
+    shortlist_size = min(limit * SHORTLIST_FACTOR, MAX_EF_SEARCH)
+    cur.execute("SET LOCAL hnsw.ef_search = %s", (max(40, shortlist_size),))
+    cur.execute(f"""
+        WITH shortlist AS (
+            SELECT business_id
+            FROM business_embeddings
+            ORDER BY embedding::halfvec({EMBEDDING_DIM}) <=> %s::halfvec({EMBEDDING_DIM})
+            LIMIT %s
+        ),
+        ranked_chunks AS (
+            SELECT 
+                b.place_id,
+                b.name,
+                b.formatted_address,
+                b.rating,
+                b.website,
+                c.chunk_type,
+                c.chunk_text,
+                c.embedding <=> %s::vector AS distance,
+                ROW_NUMBER() OVER (PARTITION BY b.place_id ORDER BY c.embedding <=> %s::vector) AS rank
+            FROM shortlist s
+            JOIN business_chunks c ON c.business_id = s.business_id
+            JOIN businesses b ON b.place_id = c.business_id
+            WHERE c.embedding IS NOT NULL
+        )
+        SELECT 
+            place_id,
+            name,
+            formatted_address,
+            rating,
+            website,
+            chunk_type,
+            chunk_text,
+            distance
+        FROM ranked_chunks
+        WHERE rank = 1  -- only keep the best matching chunk per business
+        ORDER BY distance
+        LIMIT %s
+    """, (query_vector, shortlist_size, query_vector, query_vector, limit))
+    return cur.fetchall()
+
+def chunk_search(cur, query_vector, limit):
+    """Best matching chunk per business over every chunk (no business-level table needed)"""
     cur.execute("""
         WITH ranked_chunks AS (
             SELECT 
@@ -61,8 +109,23 @@ def search_businesses(query, limit=10):
         ORDER BY distance
         LIMIT %s
     """, (query_vector, query_vector, limit))
+    return cur.fetchall()
+
+def search_businesses(query, limit=10):
+    conn = psycopg2.connect(DB_URL)
+    cur = conn.cursor()
+    
+    query_vector = get_query_embedding(query)
+    
+    # Fall back to the chunk-level scan until add_embedding.py has built business_embeddings
+    try:
+        results = shortlist_search(cur, query_vector, limit)
+    except psycopg2.errors.UndefinedTable:
+        conn.rollback()
+        results = []
+    if not results:
+        results = chunk_search(cur, query_vector, limit)
     
-    results = cur.fetchall()
     cur.close()
     conn.close()
     
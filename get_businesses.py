@@ -4,7 +4,7 @@ Writes directly to Supabase as it scrapes
 pip install requests python-dotenv tqdm psycopg2-binary
 """
 
-import os, time, requests
+import os, time, json, hashlib, argparse, requests
 from tqdm import tqdm
 from itertools import product
 from dotenv import load_dotenv
@@ -45,7 +45,9 @@ def nearby_search(lat, lng, place_type, page_token=None):
         return [], None
     return data.get("results", []), data.get("next_page_token")
 
-def get_place_details(place_id):
+def fetch_place_details(place_id):
+    """Details call that also returns the API status, so callers can tell a
+    missing place_id apart from quota/auth errors"""
     url = "https://maps.googleapis.com/maps/api/place/details/json"
     params = {
         "place_id": place_id,
@@ -54,70 +56,254 @@ def get_place_details(place_id):
         "key": API_KEY,
     }
     data = requests.get(url, params=params, timeout=10).json()
-    return data.get("result") if data.get("status") == "OK" else None
+    status = data.get("status")
+    return (data.get("result") if status == "OK" else None), status
+
+def get_place_details(place_id):
+    return fetch_place_details(place_id)[0]
 
 # --- Database operations ---
-def save_business_to_db(cur, raw):
-    """Insert business into businesses table"""
+MAX_FETCH_FAILURES = 3
+# Details statuses meaning the place_id itself is gone
+GONE_STATUSES = ("NOT_FOUND", "INVALID_REQUEST")
+# Statuses meaning every further call will fail too (quota, bad key)
+FATAL_STATUSES = ("OVER_QUERY_LIMIT", "OVER_DAILY_LIMIT", "REQUEST_DENIED")
+
+# Business fields that come from the details payload (nearby search only supplies vicinity/lat/lng)
+DETAIL_FIELDS = ["name", "formatted_address", "formatted_phone_number", "website", "rating",
+                 "user_ratings_total", "types", "business_status"]
+
+def ensure_refresh_columns(cur):
+    """Add the bookkeeping columns used by incremental refresh"""
+    cur.execute("""
+        ALTER TABLE businesses
+            ADD COLUMN IF NOT EXISTS last_fetched TIMESTAMPTZ,
+            ADD COLUMN IF NOT EXISTS details_hash TEXT,
+            ADD COLUMN IF NOT EXISTS fetch_failures INTEGER NOT NULL DEFAULT 0
+    """)
+    cur.execute("""
+        ALTER TABLE business_chunks
+            ADD COLUMN IF NOT EXISTS review_key TEXT,
+            ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ DEFAULT now()
+    """)
+
+def review_key(review):
+    """Stable identity for a review so edits update the same chunk"""
+    if review.get("author_name") is None or review.get("time") is None:
+        return None
+    return f"{review['author_name']}:{review['time']}"
+
+def hash_details(details):
+    """Content hash of the parts of a details payload we store.
+
+    Volatile fields (relative_time_description, profile photos) and review
+    order are left out so an unchanged business hashes the same every time.
+    """
+    normalized = {field: details.get(field) for field in DETAIL_FIELDS}
+    normalized["opening_hours"] = details.get("opening_hours", {}).get("weekday_text")
+    normalized["reviews"] = sorted(
+        (r.get("author_name") or "", r.get("time") or 0, r.get("rating") or 0, r.get("text") or "")
+        for r in details.get("reviews", [])
+    )
+    payload = json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def upsert_business(cur, place_id, details, raw=None):
+    """Insert or update a business row from its details (and nearby search result, if any)"""
+    raw = raw or {}
     geo = raw.get("geometry", {}).get("location", {})
-    business_name = raw.get("name")
-    
-    # Get details immediately for this business
-    details = get_place_details(raw.get("place_id"))
-    
+
     if details:
-        website = details.get("website")
-        phone = details.get("formatted_phone_number")
-        formatted_address = details.get("formatted_address")
+        # Detail fields take the fresh value (so removed websites/hours are cleared);
+        # only the nearby-search fields keep their stored value when absent
+        on_conflict = """DO UPDATE SET
+            name = EXCLUDED.name,
+            formatted_address = EXCLUDED.formatted_address,
+            vicinity = COALESCE(EXCLUDED.vicinity, businesses.vicinity),
+            phone = EXCLUDED.phone,
+            website = EXCLUDED.website,
+            rating = EXCLUDED.rating,
+            user_ratings_total = EXCLUDED.user_ratings_total,
+            types = EXCLUDED.types,
+            opening_hours = EXCLUDED.opening_hours,
+            lat = COALESCE(EXCLUDED.lat, businesses.lat),
+            lng = COALESCE(EXCLUDED.lng, businesses.lng),
+            business_status = EXCLUDED.business_status,
+            last_fetched = EXCLUDED.last_fetched,
+            details_hash = EXCLUDED.details_hash,
+            fetch_failures = 0"""
+        source = details
         opening_hours = details.get("opening_hours", {}).get("weekday_text", [])
-        reviews = details.get("reviews", [])
+        details_hash = hash_details(details)
     else:
-        website = phone = formatted_address = None
+        # No details fetched: insert what nearby search gave us, leave last_fetched NULL
+        on_conflict = "DO NOTHING"
+        source = raw
         opening_hours = []
-        reviews = []
-    
-    # Insert into businesses table
+        details_hash = None
+
     cur.execute("""
         INSERT INTO businesses 
             (place_id, name, formatted_address, vicinity, phone, website,
-             rating, user_ratings_total, types, opening_hours, lat, lng, business_status)
-        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-        ON CONFLICT (place_id) DO NOTHING
-    """, (
-        raw.get("place_id"),
-        business_name,
-        formatted_address,
+             rating, user_ratings_total, types, opening_hours, lat, lng, business_status,
+             last_fetched, details_hash)
+        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,CASE WHEN %s THEN now() END,%s)
+        ON CONFLICT (place_id) """ + on_conflict, (
+        place_id,
+        source.get("name") or raw.get("name"),
+        source.get("formatted_address"),
         raw.get("vicinity"),
-        phone,
-        website,
-        raw.get("rating"),
-        raw.get("user_ratings_total"),
-        raw.get("types", []),
+        source.get("formatted_phone_number"),
+        source.get("website"),
+        source.get("rating"),
+        source.get("user_ratings_total"),
+        source.get("types", []),
         opening_hours,
         geo.get("lat"),
         geo.get("lng"),
-        raw.get("business_status")
+        source.get("business_status"),
+        bool(details),
+        details_hash,
     ))
-    
-    print(f"  ✓ Saved: {business_name}")
-    
-    # Insert reviews as chunks
+
+def sync_chunks(cur, place_id, reviews, description):
+    """Diff review/description chunks against the DB.
+
+    Reviews are matched on (author_name, time): new reviews are inserted and
+    edited ones updated in place, both with a NULL embedding so
+    add_embedding.py re-embeds just those rows. Returns the number of
+    chunks that need embedding.
+    """
+    cur.execute("""
+        SELECT id, chunk_type, chunk_text, review_key FROM business_chunks WHERE business_id = %s
+    """, (place_id,))
+    existing = cur.fetchall()
+    keyed_reviews = {key: (row_id, text) for row_id, chunk_type, text, key in existing
+                     if chunk_type == "review" and key is not None}
+    # Rows written before review_key existed; adopted by matching text
+    unkeyed_reviews = {text: row_id for row_id, chunk_type, text, key in existing
+                       if chunk_type == "review" and key is None}
+    descriptions = [(row_id, text) for row_id, chunk_type, text, _ in existing if chunk_type == "description"]
+    changed = 0
+
     for review in reviews:
-        if review.get("text"):
+        text = review.get("text")
+        if not text:
+            continue
+        key = review_key(review)
+
+        if key is not None and key in keyed_reviews:
+            row_id, old_text = keyed_reviews[key]
+            if old_text != text:
+                cur.execute("""
+                    UPDATE business_chunks SET chunk_text = %s, embedding = NULL, updated_at = now() WHERE id = %s
+                """, (text, row_id))
+                keyed_reviews[key] = (row_id, text)
+                changed += 1
+        elif text in unkeyed_reviews:
+            row_id = unkeyed_reviews.pop(text)
+            if key is not None:
+                cur.execute("UPDATE business_chunks SET review_key = %s WHERE id = %s", (key, row_id))
+                keyed_reviews[key] = (row_id, text)
+        else:
+            cur.execute("""
+                INSERT INTO business_chunks (business_id, chunk_type, chunk_text, review_key)
+                VALUES (%s, %s, %s, %s)
+            """, (place_id, "review", text, key))
+            if key is not None:
+                keyed_reviews[key] = (None, text)
+            changed += 1
+
+    # Keep a single description chunk per business
+    if not descriptions:
+        cur.execute("""
+            INSERT INTO business_chunks (business_id, chunk_type, chunk_text)
+            VALUES (%s, %s, %s)
+        """, (place_id, "description", description))
+        changed += 1
+    else:
+        row_id, text = descriptions[0]
+        if text != description:
             cur.execute("""
-                INSERT INTO business_chunks (business_id, chunk_type, chunk_text)
-                VALUES (%s, %s, %s)
-            """, (raw.get("place_id"), "review", review["text"]))
+                UPDATE business_chunks SET chunk_text = %s, embedding = NULL, updated_at = now() WHERE id = %s
+            """, (description, row_id))
+            changed += 1
+        if len(descriptions) > 1:
+            cur.execute("DELETE FROM business_chunks WHERE id = ANY(%s)",
+                        ([d[0] for d in descriptions[1:]],))
+
+    return changed
+
+def save_business_to_db(cur, raw):
+    """Upsert business into businesses table and sync its chunks"""
+    place_id = raw.get("place_id")
+    business_name = raw.get("name")
+    
+    # Get details immediately for this business
+    details = get_place_details(place_id)
+    reviews = details.get("reviews", []) if details else []
+    
+    upsert_business(cur, place_id, details, raw)
+    print(f"  ✓ Saved: {business_name}")
     
-    # Insert description chunk
     description = f"{business_name} located at {raw.get('vicinity')}"
-    cur.execute("""
-        INSERT INTO business_chunks (business_id, chunk_type, chunk_text)
-        VALUES (%s, %s, %s)
-    """, (raw.get("place_id"), "description", description))
+    sync_chunks(cur, place_id, reviews, description)
     
     time.sleep(0.05)  # rate limiting for details API
 
+def refresh_business(cur, place_id, vicinity):
+    """Re-fetch details for one business.
+
+    Returns (changed, chunks queued for embedding). Raises RuntimeError on
+    quota/auth errors so the run stops without touching any rows.
+    """
+    details, status = fetch_place_details(place_id)
+    if status in FATAL_STATUSES:
+        raise RuntimeError(f"Places API returned {status}")
+    if status in GONE_STATUSES:
+        # Expired/removed place_id: record the attempt so it backs off instead
+        # of staying at the top of the stale queue
+        cur.execute("""
+            UPDATE businesses SET last_fetched = now(), fetch_failures = fetch_failures + 1
+            WHERE place_id = %s
+        """, (place_id,))
+        return False, 0
+    if not details:
+        # UNKNOWN_ERROR etc. are transient; leave the row to be retried next run
+        print(f"  [warn] {status} for {place_id}")
+        return False, 0
+
+    new_hash = hash_details(details)
+    cur.execute("SELECT details_hash FROM businesses WHERE place_id = %s", (place_id,))
+    row = cur.fetchone()
+    if row and row[0] == new_hash:
+        # Unchanged payload: just mark it fresh, no upsert or re-embedding
+        cur.execute("""
+            UPDATE businesses SET last_fetched = now(), fetch_failures = 0 WHERE place_id = %s
+        """, (place_id,))
+        return False, 0
+
+    upsert_business(cur, place_id, details)
+    description = f"{details.get('name')} located at {vicinity}"
+    return True, sync_chunks(cur, place_id, details.get("reviews", []), description)
+
+def get_stale_businesses(cur, max_age_days, limit):
+    """Businesses not fetched within max_age_days, oldest and most popular first.
+
+    Gone place_ids back off linearly and are dropped after MAX_FETCH_FAILURES.
+    """
+    cur.execute("""
+        SELECT place_id, vicinity
+        FROM businesses
+        WHERE fetch_failures < %s
+          AND (last_fetched IS NULL
+               OR last_fetched < now() - make_interval(days => %s * (1 + fetch_failures)))
+        ORDER BY EXTRACT(EPOCH FROM now() - COALESCE(last_fetched, 'epoch'::timestamptz))
+                 * LN(2 + COALESCE(user_ratings_total, 0)) DESC
+        LIMIT %s
+    """, (MAX_FETCH_FAILURES, max_age_days, limit))
+    return cur.fetchall()
+
 # --- Helpers ---
 def is_chain(name, seen_names, threshold=4):
     return seen_names.get(name.lower(), 0) >= threshold
@@ -131,6 +317,8 @@ def check_if_exists(cur, place_id):
 def scrape_toronto():
     conn = psycopg2.connect(DB_URL)
     cur = conn.cursor()
+    ensure_refresh_columns(cur)
+    conn.commit()
     
     grid = generate_grid()
     seen_names = {}
@@ -177,6 +365,39 @@ def scrape_toronto():
     
     return total_added
 
+# --- Incremental refresh ---
+def refresh_stale(max_age_days=30, limit=200):
+    """Re-fetch details only for stale businesses and upsert what changed"""
+    conn = psycopg2.connect(DB_URL)
+    cur = conn.cursor()
+    ensure_refresh_columns(cur)
+    conn.commit()
+
+    stale = get_stale_businesses(cur, max_age_days, limit)
+    total_changed = total_queued = 0
+
+    try:
+        for place_id, vicinity in tqdm(stale, desc="Refreshing", unit="biz"):
+            try:
+                changed, queued = refresh_business(cur, place_id, vicinity)
+            except requests.exceptions.RequestException as e:
+                print(f"\n  [warn] {place_id}: {e}")
+                conn.rollback()
+                continue
+            except RuntimeError as e:
+                print(f"\n  [error] {e}, stopping refresh")
+                conn.rollback()
+                break
+            total_changed += changed
+            total_queued += queued
+            conn.commit()  # commit after each business
+            time.sleep(0.05)  # rate limiting for details API
+    finally:
+        cur.close()
+        conn.close()
+
+    return len(stale), total_changed, total_queued
+
 # --- Entry point ---
 if __name__ == "__main__":
     if not API_KEY:
@@ -184,5 +405,18 @@ if __name__ == "__main__":
     if not DB_URL:
         raise ValueError("Set POSTGRES_URL in your .env")
 
-    total = scrape_toronto()
-    print(f"\nAdded {total} businesses to database")  
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--refresh", action="store_true",
+                        help="re-fetch stale businesses instead of scraping new ones")
+    parser.add_argument("--max-age-days", type=int, default=30)
+    parser.add_argument("--limit", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.refresh:
+        checked, changed, queued = refresh_stale(args.max_age_days, args.limit)
+        print(f"\nRefreshed {checked} businesses, {changed} changed, "
+              f"{queued} chunks queued for embedding")
+        print("Run add_embedding.py to embed new or changed chunks")
+    else:
+        total = scrape_toronto()
+        print(f"\nAdded {total} businesses to database")  
\ No newline at end of file
@@ -0,0 +1,74 @@
+from get_businesses import hash_details, sync_chunks
+
+DESCRIPTION = "Cafe located at 1 King St"
+
+class FakeCursor:
+    """Records executed SQL and returns canned rows for the chunk lookup"""
+    def __init__(self, rows):
+        self.rows = rows
+        self.executed = []
+
+    def execute(self, sql, params=None):
+        self.executed.append((" ".join(sql.split()), params))
+
+    def fetchall(self):
+        return self.rows
+
+    def statements(self, prefix):
+        return [(sql, params) for sql, params in self.executed if sql.startswith(prefix)]
+
+def make_details(reviews):
+    return {
+        "name": "Cafe",
+        "website": "https://cafe.example",
+        "opening_hours": {"weekday_text": ["Monday: 8AM-5PM"]},
+        "reviews": reviews,
+    }
+
+def test_hash_ignores_volatile_fields_and_review_order():
+    a = {"author_name": "Ann", "time": 100, "rating": 5, "text": "great coffee",
+         "relative_time_description": "2 weeks ago", "profile_photo_url": "https://a/1"}
+    b = {"author_name": "Bob", "time": 200, "rating": 3, "text": "slow service",
+         "relative_time_description": "a month ago", "profile_photo_url": "https://b/1"}
+    later_a = dict(a, relative_time_description="3 weeks ago", profile_photo_url="https://a/2")
+
+    assert hash_details(make_details([a, b])) == hash_details(make_details([b, later_a]))
+    assert hash_details(make_details([a, b])) != hash_details(make_details([dict(a, text="ok coffee"), b]))
+
+def test_edited_review_updates_row_and_clears_embedding():
+    cur = FakeCursor([
+        (1, "review", "great coffee", "Ann:100"),
+        (2, "description", DESCRIPTION, None),
+    ])
+    queued = sync_chunks(cur, "pid", [{"author_name": "Ann", "time": 100, "text": "great coffee, rude staff"}],
+                         DESCRIPTION)
+
+    updates = cur.statements("UPDATE business_chunks SET chunk_text")
+    assert queued == 1
+    assert len(updates) == 1
+    assert "embedding = NULL" in updates[0][0]
+    assert updates[0][1] == ("great coffee, rude staff", 1)
+    assert not cur.statements("INSERT")
+
+def test_unkeyed_legacy_review_is_adopted_by_text():
+    cur = FakeCursor([
+        (1, "review", "great coffee", None),
+        (2, "description", DESCRIPTION, None),
+    ])
+    queued = sync_chunks(cur, "pid", [{"author_name": "Ann", "time": 100, "text": "great coffee"}], DESCRIPTION)
+
+    assert queued == 0
+    assert cur.statements("UPDATE business_chunks SET review_key")[0][1] == ("Ann:100", 1)
+    assert not cur.statements("INSERT")
+
+def test_extra_description_chunks_are_deleted():
+    cur = FakeCursor([
+        (1, "description", DESCRIPTION, None),
+        (2, "description", DESCRIPTION, None),
+        (3, "description", DESCRIPTION, None),
+    ])
+    queued = sync_chunks(cur, "pid", [], DESCRIPTION)
+
+    assert queued == 0
+    assert cur.statements("DELETE FROM business_chunks")[0][1] == ([2, 3],)
+    assert not cur.statements("INSERT")